@@ -22,8 +22,7 @@ compute_stack = ComputeStack(
     env=env
 )
 
-# Stack dependencies
-compute_stack.add_dependency(network_stack)
-compute_stack.add_dependency(data_stack)
+# ComputeStack depends on NetworkStack and DataStack implicitly through the
+# VPC and table references above; no explicit add_dependency is needed
 
 app.synth()
@@ -1,5 +1,7 @@
+import os
+
 from aws_cdk import (
-    Stack, CfnOutput, Duration,
+    Stack, CfnOutput, Duration, Annotations,
     aws_ec2 as ec2,
     aws_ecs as ecs,
     aws_elasticloadbalancingv2 as elbv2,
@@ -8,47 +10,127 @@ from aws_cdk import (
     aws_dynamodb as dynamodb,
     aws_ssm as ssm,
     aws_applicationautoscaling as appscaling,
+    aws_ecr as ecr,
     aws_ecr_assets as ecr_assets
 )
 from constructs import Construct
 
+# How long a WebSocket connection (and its sticky session) may stay idle
+WS_IDLE_TIMEOUT = Duration.hours(1)
+
 class ComputeStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, vpc: ec2.Vpc, 
                  table: dynamodb.Table, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         
-        # Get configurable paths from context
-        web_path = self.node.try_get_context("web_image_path") or "../web"
-        game_path = self.node.try_get_context("game_image_path") or "../game"
+        # Read configuration from context once, up front
+        ctx = self.node.try_get_context
+        web_path = ctx("web_image_path") or "../web"
+        game_path = ctx("game_image_path") or "../game"
+        image_path = ctx("image_path")
+        api_base_url = ctx("api_base_url") or ""
+        web_image_repository = ctx("web_image_repository")
+        web_image_digest = ctx("web_image_digest")
+        game_image_repository = ctx("game_image_repository")
+        game_image_digest = ctx("game_image_digest")
+        image_cache_repository = ctx("image_cache_repository")
+        # Task sizes: web is CPU-bound request handling, game holds WebSocket state in memory
+        web_cpu = int(ctx("web_cpu") or 512)
+        web_mem = int(ctx("web_mem") or 1024)
+        game_cpu = int(ctx("game_cpu") or 256)
+        game_mem = int(ctx("game_mem") or 2048)
+        # Set by `cdk ls` wrappers to skip Docker context hashing
+        skip_assets = os.environ.get("CDK_SKIP_ASSETS") == "1"
         
         # ECS Cluster
-        cluster = ecs.Cluster(self, "WordBashCluster", vpc=vpc)
+        cluster = ecs.Cluster(
+            self, "WordBashCluster",
+            vpc=vpc,
+            enable_fargate_capacity_providers=True
+        )
 
-        # Application Load Balancer
+        # Application Load Balancer; the idle timeout keeps quiet WebSocket
+        # connections open instead of dropping them after the 60s default
         alb_sg = self._create_alb_security_group(vpc)
         alb = elbv2.ApplicationLoadBalancer(
             self, "WordBashALB",
             vpc=vpc,
             internet_facing=True,
-            security_group=alb_sg
+            security_group=alb_sg,
+            idle_timeout=WS_IDLE_TIMEOUT,
+            http2_enabled=True
         )
+        
+        # WebSocket endpoint is known at synth time, so it is injected directly
+        # into the web container; the SSM parameter is kept for compatibility
+        ws_endpoint = f"ws://{alb.load_balancer_dns_name}/ws"
+        ws_param_path = "/wordbash/ws_endpoint"
 
-        # Build Docker images for linux/amd64 platform
-        web_image = ecr_assets.DockerImageAsset(
-            self, "WebImage", 
-            directory=web_path,
-            platform=ecr_assets.Platform.LINUX_AMD64
+        # Build Docker images for linux/amd64 platform. When a shared context
+        # with a multi-stage Dockerfile is configured, both images build from it
+        # so the common base layers are built and pushed only once.
+        web_image = self._create_image(
+            "WebImage", image_path or web_path,
+            target="web" if image_path else None,
+            repository_name=web_image_repository,
+            digest=web_image_digest,
+            cache_ref=f"{image_cache_repository}:web" if image_cache_repository else None,
+            skip_build=skip_assets
+        )
+        game_image = self._create_image(
+            "GameImage", image_path or game_path,
+            target="game" if image_path else None,
+            repository_name=game_image_repository,
+            digest=game_image_digest,
+            cache_ref=f"{image_cache_repository}:game" if image_cache_repository else None,
+            skip_build=skip_assets
+        )
+        
+        # Single log group shared by both services, split by stream prefix
+        log_group = logs.LogGroup(
+            self, "EcsLogGroup",
+            log_group_name="/aws/ecs/wordbash",
+            retention=logs.RetentionDays.TWO_WEEKS
         )
-        game_image = ecr_assets.DockerImageAsset(
-            self, "GameImage", 
-            directory=game_path,
-            platform=ecr_assets.Platform.LINUX_AMD64
+        
+        # Task role with DynamoDB permissions, shared by both services
+        task_role = iam.Role(
+            self, "EcsTaskRole",
+            assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com")
+        )
+        table.grant_read_write_data(task_role)
+        
+        # Execution role shared by both task definitions; CDK adds the ECR pull
+        # and log write grants to it as each container is registered
+        execution_role = iam.Role(
+            self, "EcsExecutionRole",
+            assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com")
         )
         
         # Create services
         service_sg = self._create_service_security_group(vpc, alb_sg)
-        web_service = self._create_web_service(cluster, web_image, table, service_sg)
-        game_service = self._create_game_service(cluster, game_image, table, service_sg)
+        web_service = self._create_service(
+            "Web", cluster, web_image, table, task_role, execution_role, service_sg, log_group,
+            cpu=web_cpu,
+            memory_limit_mib=web_mem,
+            extra_env={
+                "WS_ENDPOINT": ws_endpoint,
+                "WS_ENDPOINT_PARAM": ws_param_path,
+                "API_BASE_URL": api_base_url
+            }
+        )
+        game_service = self._create_service(
+            "Game", cluster, game_image, table, task_role, execution_role, service_sg, log_group,
+            cpu=game_cpu,
+            memory_limit_mib=game_mem,
+            # One on-demand task as a floor, extra replicas mostly on Spot
+            capacity_provider_strategies=[
+                ecs.CapacityProviderStrategy(capacity_provider="FARGATE", weight=1, base=1),
+                ecs.CapacityProviderStrategy(capacity_provider="FARGATE_SPOT", weight=3)
+            ]
+        )
+        # The strategy names FARGATE_SPOT, so wait for the cluster's capacity provider association
+        game_service.node.add_dependency(cluster)
         
         # Target groups and listener rules
         web_tg = self._create_web_target_group(vpc, web_service)
@@ -70,10 +152,10 @@ class ComputeStack(Stack):
             action=elbv2.ListenerAction.forward([game_tg])
         )
         
-        # Store WebSocket endpoint in SSM
-        ws_endpoint = f"ws://{alb.load_balancer_dns_name}/ws"
-        ws_param_path = "/wordbash/ws_endpoint"
+        # Request-count scaling needs game_tg attached to the listener first
+        self._create_autoscaling(web_service, game_service, game_tg)
         
+        # Store WebSocket endpoint in SSM
         ssm.StringParameter(
             self, "WsEndpointParam",
             parameter_name=ws_param_path,
@@ -81,11 +163,16 @@ class ComputeStack(Stack):
             description="WebSocket endpoint URL for WordBash game connections"
         )
         
-        # Grant SSM access to web service
-        web_service.task_definition.task_role.add_to_policy(
+        # Grant SSM access to the task role
+        ws_param_arn = self.format_arn(
+            service="ssm",
+            resource="parameter",
+            resource_name=ws_param_path.lstrip("/")
+        )
+        task_role.add_to_policy(
             iam.PolicyStatement(
                 actions=["ssm:GetParameter"],
-                resources=[f"arn:aws:ssm:{self.region}:{self.account}:parameter{ws_param_path}"]
+                resources=[ws_param_arn]
             )
         )
         
@@ -96,6 +183,52 @@ class ComputeStack(Stack):
         CfnOutput(self, "DynamoDbTableName", value=table.table_name)
         CfnOutput(self, "WsEndpointParamPath", value=ws_param_path)
     
+    def _create_image(self, construct_id: str, directory: str, target: str = None,
+                      repository_name: str = None, digest: str = None,
+                      cache_ref: str = None, skip_build: bool = False) -> ecs.ContainerImage:
+        # A pinned digest references an already-pushed image and skips the Docker build
+        if bool(digest) != bool(repository_name):
+            raise ValueError(
+                f"{construct_id}: an image repository and digest must be set together"
+            )
+        if digest:
+            repository = ecr.Repository.from_repository_name(
+                self, f"{construct_id}Repository", repository_name
+            )
+            return ecs.ContainerImage.from_ecr_repository(repository, digest)
+        
+        # Placeholder instead of a DockerImageAsset, so no build context is hashed
+        if skip_build:
+            Annotations.of(self).add_warning(
+                f"CDK_SKIP_ASSETS=1: {construct_id} uses a placeholder image, do not deploy this synth"
+            )
+            return ecs.ContainerImage.from_registry("public.ecr.aws/docker/library/busybox:latest")
+        
+        # Optional BuildKit registry cache so unchanged layers are pulled, not rebuilt
+        cache_from = cache_to = None
+        if cache_ref:
+            cache_from = [ecr_assets.DockerCacheOption(type="registry", params={"ref": cache_ref})]
+            # ECR only accepts cache exported as an OCI image manifest
+            cache_to = ecr_assets.DockerCacheOption(
+                type="registry",
+                params={
+                    "ref": cache_ref,
+                    "mode": "max",
+                    "image-manifest": "true",
+                    "oci-mediatypes": "true"
+                }
+            )
+        
+        asset = ecr_assets.DockerImageAsset(
+            self, construct_id,
+            directory=directory,
+            target=target,
+            platform=ecr_assets.Platform.LINUX_AMD64,
+            cache_from=cache_from,
+            cache_to=cache_to
+        )
+        return ecs.ContainerImage.from_docker_image_asset(asset)
+    
     def _create_alb_security_group(self, vpc: ec2.Vpc) -> ec2.SecurityGroup:
         sg = ec2.SecurityGroup(self, "AlbSecurityGroup", vpc=vpc)
         # Only allow access from your IP
@@ -107,119 +240,88 @@ class ComputeStack(Stack):
         sg.add_ingress_rule(alb_sg, ec2.Port.tcp(8080))  # Container port
         return sg
     
-    def _create_web_service(self, cluster: ecs.Cluster, image: ecr_assets.DockerImageAsset, 
-                           table: dynamodb.Table, security_group: ec2.SecurityGroup) -> ecs.FargateService:
-        
-        # Task role with DynamoDB permissions
-        task_role = iam.Role(
-            self, "WebTaskRole",
-            assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com")
-        )
-        table.grant_read_write_data(task_role)
-        
+    def _create_service(self, name: str, cluster: ecs.Cluster, image: ecs.ContainerImage,
+                        table: dynamodb.Table, task_role: iam.Role, execution_role: iam.Role,
+                        security_group: ec2.SecurityGroup,
+                        log_group: logs.LogGroup, cpu: int, memory_limit_mib: int,
+                        capacity_provider_strategies: list = None,
+                        extra_env: dict = None) -> ecs.FargateService:
         # Task definition
         task_def = ecs.FargateTaskDefinition(
-            self, "WebTaskDef",
-            memory_limit_mib=1024,
-            cpu=512,
-            task_role=task_role
+            self, f"{name}TaskDef",
+            memory_limit_mib=memory_limit_mib,
+            cpu=cpu,
+            task_role=task_role,
+            execution_role=execution_role,
+            runtime_platform=ecs.RuntimePlatform(
+                operating_system_family=ecs.OperatingSystemFamily.LINUX,
+                cpu_architecture=ecs.CpuArchitecture.X86_64
+            )
         )
         
         # Container with environment variables
-        container = task_def.add_container(
-            "WebContainer",
-            image=ecs.ContainerImage.from_docker_image_asset(image),
+        task_def.add_container(
+            f"{name}Container",
+            image=image,
             port_mappings=[ecs.PortMapping(container_port=8080)],
             environment={
                 "AWS_REGION": self.region,
                 "LOG_LEVEL": "INFO",
                 "DDB_TABLE_NAME": table.table_name,
-                "WS_ENDPOINT_PARAM": "/wordbash/ws_endpoint",
-                "API_BASE_URL": self.node.try_get_context("api_base_url") or ""
+                **(extra_env or {})
             },
             logging=ecs.LogDrivers.aws_logs(
-                stream_prefix="web",
-                log_group=logs.LogGroup(
-                    self, "WebLogGroup",
-                    log_group_name="/aws/ecs/wordbash-web",
-                    retention=logs.RetentionDays.TWO_WEEKS
-                )
+                stream_prefix=name.lower(),
+                log_group=log_group
             )
         )
         
         # Fargate service
         service = ecs.FargateService(
-            self, "WebService",
+            self, f"{name}Service",
             cluster=cluster,
             task_definition=task_def,
             desired_count=1,
+            platform_version=ecs.FargatePlatformVersion.VERSION1_4,  # Required for SOCI lazy loading
+            capacity_provider_strategies=capacity_provider_strategies,
             security_groups=[security_group]
         )
         
-        # Auto scaling
-        scaling = service.auto_scale_task_count(max_capacity=4, min_capacity=1)
-        scaling.scale_on_cpu_utilization(
+        return service
+    
+    def _create_autoscaling(self, web_service: ecs.FargateService, game_service: ecs.FargateService,
+                            game_tg: elbv2.ApplicationTargetGroup) -> None:
+        # Web is CPU-bound
+        web_scaling = web_service.auto_scale_task_count(max_capacity=4, min_capacity=1)
+        web_scaling.scale_on_cpu_utilization(
             "WebCpuScaling",
             target_utilization_percent=50
         )
         
-        return service
-    
-    def _create_game_service(self, cluster: ecs.Cluster, image: ecr_assets.DockerImageAsset,
-                            table: dynamodb.Table, security_group: ec2.SecurityGroup) -> ecs.FargateService:
-        
-        # Task role with DynamoDB permissions  
-        task_role = iam.Role(
-            self, "GameTaskRole",
-            assumed_by=iam.ServicePrincipal("ecs-tasks.amazonaws.com")
+        # Game is memory-bound; ALB request count scales out before load shows up
+        # in task metrics, avoiding a cold Fargate start on the player's critical path
+        game_scaling = game_service.auto_scale_task_count(max_capacity=4, min_capacity=1)
+        game_scaling.scale_on_memory_utilization(
+            "GameMemoryScaling",
+            target_utilization_percent=70
         )
-        table.grant_read_write_data(task_role)
-        
-        # Task definition
-        task_def = ecs.FargateTaskDefinition(
-            self, "GameTaskDef",
-            memory_limit_mib=1024,
-            cpu=512,
-            task_role=task_role
+        game_scaling.scale_on_request_count(
+            "GameReqScaling",
+            requests_per_target=50,
+            target_group=game_tg
         )
         
-        # Container
-        container = task_def.add_container(
-            "GameContainer",
-            image=ecs.ContainerImage.from_docker_image_asset(image),
-            port_mappings=[ecs.PortMapping(container_port=8080)],
-            environment={
-                "AWS_REGION": self.region,
-                "LOG_LEVEL": "INFO", 
-                "DDB_TABLE_NAME": table.table_name
-            },
-            logging=ecs.LogDrivers.aws_logs(
-                stream_prefix="game",
-                log_group=logs.LogGroup(
-                    self, "GameLogGroup",
-                    log_group_name="/aws/ecs/wordbash-game",
-                    retention=logs.RetentionDays.TWO_WEEKS
-                )
-            )
+        # Keep warm capacity through evening peak hours (UTC)
+        game_scaling.scale_on_schedule(
+            "PeakStart",
+            schedule=appscaling.Schedule.cron(hour="17", minute="0"),
+            min_capacity=3
         )
-        
-        # Fargate service
-        service = ecs.FargateService(
-            self, "GameService",
-            cluster=cluster,
-            task_definition=task_def,
-            desired_count=1,
-            security_groups=[security_group]
-        )
-        
-        # Auto scaling
-        scaling = service.auto_scale_task_count(max_capacity=4, min_capacity=1)
-        scaling.scale_on_cpu_utilization(
-            "GameCpuScaling",
-            target_utilization_percent=50
+        game_scaling.scale_on_schedule(
+            "PeakEnd",
+            schedule=appscaling.Schedule.cron(hour="23", minute="0"),
+            min_capacity=1
         )
-        
-        return service
     
     def _create_web_target_group(self, vpc: ec2.Vpc, service: ecs.FargateService) -> elbv2.ApplicationTargetGroup:
         tg = elbv2.ApplicationTargetGroup(
@@ -228,6 +330,7 @@ class ComputeStack(Stack):
             port=8080,
             protocol=elbv2.ApplicationProtocol.HTTP,
             target_type=elbv2.TargetType.IP,
+            targets=[service.load_balancer_target(container_name="WebContainer", container_port=8080)],
             health_check=elbv2.HealthCheck(
                 path="/healthz",
                 healthy_threshold_count=2,
@@ -236,7 +339,8 @@ class ComputeStack(Stack):
                 interval=Duration.seconds(30)
             )
         )
-        service.attach_to_application_target_group(tg)
+        # Short connection draining so rolling deploys are not held for the 300s default
+        tg.set_attribute("deregistration_delay.timeout_seconds", "30")
         return tg
     
     def _create_game_target_group(self, vpc: ec2.Vpc, service: ecs.FargateService) -> elbv2.ApplicationTargetGroup:
@@ -247,6 +351,7 @@ class ComputeStack(Stack):
             port=8080,
             protocol=elbv2.ApplicationProtocol.HTTP,
             target_type=elbv2.TargetType.IP,
+            targets=[service.load_balancer_target(container_name="GameContainer", container_port=8080)],
             health_check=elbv2.HealthCheck(
                 path="/healthz",
                 healthy_threshold_count=2,
@@ -257,13 +362,16 @@ class ComputeStack(Stack):
         )
         
         # Configure for WebSocket support - ALB handles upgrade automatically
-        # Set idle timeout for long-lived WebSocket connections
-        cfn_tg = tg.node.default_child
-        cfn_tg.add_property_override("TargetGroupAttributes", [
-            {"Key": "deregistration_delay.timeout_seconds", "Value": "30"},
-            {"Key": "stickiness.enabled", "Value": "true"},
-            {"Key": "stickiness.type", "Value": "lb_cookie"}
-        ])
+        tg.set_attribute("deregistration_delay.timeout_seconds", "30")
+        # Sticky sessions last as long as the ALB idle timeout (both WS_IDLE_TIMEOUT)
+        # so reconnects land on the same task
+        tg.set_attribute("stickiness.enabled", "true")
+        tg.set_attribute("stickiness.type", "lb_cookie")
+        tg.set_attribute(
+            "stickiness.lb_cookie.duration_seconds",
+            str(int(WS_IDLE_TIMEOUT.to_seconds()))
+        )
+        # Spread long-lived WebSocket connections evenly across tasks
+        tg.set_attribute("load_balancing.algorithm.type", "least_outstanding_requests")
         
-        service.attach_to_application_target_group(tg)
         return tg
@@ -5,6 +5,10 @@ class DataStack(Stack):
     def __init__(self, scope: Construct, construct_id: str, **kwargs) -> None:
         super().__init__(scope, construct_id, **kwargs)
         
+        keep_data = bool(self.node.try_get_context("keep_data"))
+        # Parsed strictly: CLI context arrives as a string, and "false" must not flip billing mode
+        steady_state = self.node.try_get_context("steady_state") in (True, "true")
+        
         # DynamoDB table for WordBash games
         self.table = dynamodb.Table(
             self, "WordBashGamesTable",
@@ -13,10 +17,22 @@ class DataStack(Stack):
                 name="game_id",
                 type=dynamodb.AttributeType.STRING
             ),
-            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,  # On-demand billing
-            removal_policy=RemovalPolicy.RETAIN if Stack.of(self).node.try_get_context("keep_data") else RemovalPolicy.DESTROY
+            # Provisioned capacity is cheaper for a steady baseline, on-demand for spiky traffic
+            billing_mode=dynamodb.BillingMode.PROVISIONED if steady_state else dynamodb.BillingMode.PAY_PER_REQUEST,
+            read_capacity=5 if steady_state else None,
+            write_capacity=5 if steady_state else None,
+            time_to_live_attribute="ttl",  # Lets DynamoDB expire stale games
+            removal_policy=RemovalPolicy.RETAIN if keep_data else RemovalPolicy.DESTROY
         )
         
+        if steady_state:
+            self.table.auto_scale_read_capacity(
+                min_capacity=5, max_capacity=100
+            ).scale_on_utilization(target_utilization_percent=70)
+            self.table.auto_scale_write_capacity(
+                min_capacity=5, max_capacity=100
+            ).scale_on_utilization(target_utilization_percent=70)
+        
         # CloudFormation exports for cross-stack references
         CfnOutput(
             self, "TableArn",
@@ -9,7 +9,7 @@ class NetworkStack(Stack):
         self.vpc = ec2.Vpc(
             self, "WordBashVpc",
             max_azs=2,
-            nat_gateways=1,  # Cost optimization: single NAT for dev-friendly setup
+            nat_gateways=0,  # AWS services are reached through VPC endpoints instead
             subnet_configuration=[
                 ec2.SubnetConfiguration(
                     name="Public",
@@ -18,8 +18,18 @@ class NetworkStack(Stack):
                 ),
                 ec2.SubnetConfiguration(
                     name="Private",
-                    subnet_type=ec2.SubnetType.PRIVATE_WITH_EGRESS,
+                    subnet_type=ec2.SubnetType.PRIVATE_ISOLATED,
                     cidr_mask=24
                 )
             ]
         )
+        
+        # Gateway endpoints (no hourly charge); ECR image layers are served from S3
+        self.vpc.add_gateway_endpoint("S3Endpoint", service=ec2.GatewayVpcEndpointAwsService.S3)
+        self.vpc.add_gateway_endpoint("DynamoDbEndpoint", service=ec2.GatewayVpcEndpointAwsService.DYNAMODB)
+        
+        # Interface endpoints for image pulls, logging and parameter lookups
+        self.vpc.add_interface_endpoint("EcrEndpoint", service=ec2.InterfaceVpcEndpointAwsService.ECR)
+        self.vpc.add_interface_endpoint("EcrDockerEndpoint", service=ec2.InterfaceVpcEndpointAwsService.ECR_DOCKER)
+        self.vpc.add_interface_endpoint("LogsEndpoint", service=ec2.InterfaceVpcEndpointAwsService.CLOUDWATCH_LOGS)
+        self.vpc.add_interface_endpoint("SsmEndpoint", service=ec2.InterfaceVpcEndpointAwsService.SSM)